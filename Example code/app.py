@@ -1,32 +1,115 @@
 import os
+import atexit
 import sqlite3
 import json
 import hashlib
 import hmac
 import logging
-from datetime import datetime, timedelta
+import queue
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Optional, Tuple
 import pandas as pd
 from flask import Flask, request, jsonify
 import requests
+from requests.adapters import HTTPAdapter
 from werkzeug.security import generate_password_hash, check_password_hash
+from db_pool import SQLitePool
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# A bracketed command such as [add], ignoring surrounding whitespace
+_CMD_RE = re.compile(r'^\s*\[([^\]]+)\]\s*$')
+
+# Replies and reports are sent off the request thread so Facebook gets its
+# 200 right away
+_send_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='messenger-send')
+
 class FacebookMessengerBot:
+    # Command logs are written in batches by a background thread
+    LOG_BATCH_SIZE = 500
+    LOG_FLUSH_INTERVAL = 0.1  # seconds
+    
+    # Old command logs and expired sessions are purged periodically
+    LOG_RETENTION_DAYS = 30
+    MAINTENANCE_INTERVAL = 3600  # seconds
+    
+    # Maximum number of facebook_ids whose session expiry is kept in memory.
+    # Entries are only trusted for AUTH_CACHE_TTL seconds, which bounds how
+    # long another worker process can miss a login that relinked an account.
+    AUTH_CACHE_SIZE = 1024
+    AUTH_CACHE_TTL = 60  # seconds
+    
+    # Recent password check results, to skip repeated PBKDF2 work
+    PASSWORD_CACHE_SIZE = 1024
+    PASSWORD_CACHE_TTL = 60  # seconds
+    
+    # Graph API request timeout (seconds)
+    HTTP_TIMEOUT = 5
+    
+    HELP_TEXT = """Available commands:
+[help] - Show this help message
+[username] [password] - Login (e.g., [admin] [admin123])
+[itemID] - Set target item for operations
+[add] - Add 1 to current item count
+[subtract] - Subtract 1 from current item count
+[count] - Get current count for item
+[statistics] - Generate and send Excel report
+
+Note: You must be authenticated to use commands other than [help]."""
+    
     def __init__(self, verify_token: str, access_token: str, app_secret: str):
         self.verify_token = verify_token
         self.access_token = access_token
         self.app_secret = app_secret
+        self._secret_bytes = app_secret.encode('utf-8')
+        self._messages_url = f"https://graph.facebook.com/v18.0/me/messages?access_token={access_token}"
+        self._session = requests.Session()  # keep-alive to graph.facebook.com
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50, max_retries=3)
+        self._session.mount('https://', adapter)
+        
+        # Authenticated [command] handlers; anything else selects an item
+        self._handlers = {
+            'statistics': self._cmd_statistics,
+            'add': self._cmd_add,
+            'subtract': self._cmd_subtract,
+            'count': self._cmd_count
+        }
+        
         self.db_path = 'messenger_bot.db'
+        self.pool = SQLitePool(self.db_path)
+        self._auth_cache: OrderedDict = OrderedDict()  # facebook_id -> cache entry expiry epoch
+        self._auth_lock = threading.Lock()
+        self._pw_cache: OrderedDict = OrderedDict()  # (username, hash, sha256(password)) -> (ok, expiry)
+        self._pw_lock = threading.Lock()
         self.init_database()
         
+        self._log_queue = queue.Queue()
+        self._log_writer = threading.Thread(target=self._log_writer_loop, name='command-log-writer', daemon=True)
+        self._log_writer.start()
+        
+        self._stop_event = threading.Event()
+        self._maintenance_thread = threading.Thread(target=self._maintenance_loop, name='db-maintenance', daemon=True)
+        self._maintenance_thread.start()
+        
     def init_database(self):
         """Initialize SQLite database with required tables"""
-        conn = sqlite3.connect(self.db_path)
+        with self.pool.acquire_writer() as conn:
+            self._create_schema(conn)
+        logger.info("Database initialized successfully")
+    
+    def _create_schema(self, conn: sqlite3.Connection):
+        """Create tables and seed the default admin user"""
         cursor = conn.cursor()
+        # Several gunicorn workers may boot against a fresh database at once
+        cursor.execute('BEGIN IMMEDIATE')
         
         # Users table
         cursor.execute('''
@@ -77,177 +160,325 @@ class FacebookMessengerBot:
             )
         ''')
         
+        # Indexes for the per-message session lookup and report aggregation.
+        # items.item_id needs none, its UNIQUE constraint is already indexed.
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_fbid_expires ON user_sessions(facebook_id, expires_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_fbid_time ON command_logs(facebook_id, timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_command ON command_logs(command)')
+        
         # Create default admin user if not exists
         cursor.execute('SELECT COUNT(*) FROM users WHERE username = ?', ('admin',))
         if cursor.fetchone()[0] == 0:
             admin_hash = generate_password_hash('admin123')
             cursor.execute('''
-                INSERT INTO users (facebook_id, username, password_hash) 
+                INSERT OR IGNORE INTO users (facebook_id, username, password_hash) 
                 VALUES (?, ?, ?)
             ''', ('admin_fb_id', 'admin', admin_hash))
         
         conn.commit()
-        conn.close()
-        logger.info("Database initialized successfully")
     
-    def verify_webhook_signature(self, payload: str, signature: str) -> bool:
+    def verify_webhook_signature(self, payload: bytes, signature: str) -> bool:
         """Verify webhook signature for security"""
-        if not signature:
+        if not signature or not signature.startswith('sha256='):
             return False
         
-        expected_signature = hmac.new(
-            self.app_secret.encode('utf-8'),
-            payload.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
+        try:
+            provided_signature = bytes.fromhex(signature[len('sha256='):])
+        except ValueError:
+            return False
         
-        return hmac.compare_digest(f"sha256={expected_signature}", signature)
+        expected_signature = hmac.digest(self._secret_bytes, payload, 'sha256')
+        return hmac.compare_digest(expected_signature, provided_signature)
     
     def log_command(self, facebook_id: str, command: str, parameters: str = None, 
                    success: bool = True, error_message: str = None):
-        """Log command execution to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO command_logs (facebook_id, command, parameters, success, error_message)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (facebook_id, command, parameters, int(success), error_message))
+        """Queue command execution log for the background writer"""
+        # Stamp now in CURRENT_TIMESTAMP's format, the row may be written later
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self._log_queue.put((facebook_id, command, parameters, int(success), error_message, timestamp))
+    
+    def _log_writer_loop(self):
+        """Drain queued command logs into the database in batches"""
+        while True:
+            item = self._log_queue.get()
+            batch, markers = [], []
+            deadline = time.monotonic() + self.LOG_FLUSH_INTERVAL
+            
+            while True:
+                # A flush marker ends the batch early so its waiter isn't delayed
+                if isinstance(item, threading.Event):
+                    markers.append(item)
+                    break
+                batch.append(item)
+                
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.LOG_BATCH_SIZE or remaining <= 0:
+                    break
+                try:
+                    item = self._log_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            
+            try:
+                if batch:
+                    with self.pool.acquire_writer() as conn:
+                        conn.executemany('''
+                            INSERT INTO command_logs (facebook_id, command, parameters, success, error_message, timestamp)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        ''', batch)
+                        conn.commit()
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} command logs: {e}")
+            finally:
+                for marker in markers:
+                    marker.set()
+    
+    def flush_logs(self):
+        """Block until every command log queued before this call has been written"""
+        marker = threading.Event()
+        self._log_queue.put(marker)
+        marker.wait()
+    
+    def _maintenance_loop(self):
+        """Run database maintenance every MAINTENANCE_INTERVAL seconds"""
+        while not self._stop_event.wait(self.MAINTENANCE_INTERVAL):
+            try:
+                self.run_maintenance()
+            except Exception as e:
+                logger.error(f"Database maintenance failed: {e}")
+    
+    def run_maintenance(self):
+        """Purge old command logs and expired sessions, then truncate the WAL"""
+        with self.pool.acquire_writer() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "DELETE FROM command_logs WHERE timestamp < datetime('now', ?)",
+                (f'-{self.LOG_RETENTION_DAYS} days',)
+            )
+            logs_deleted = cursor.rowcount
+            
+            cursor.execute('DELETE FROM user_sessions WHERE expires_at < CURRENT_TIMESTAMP')
+            sessions_deleted = cursor.rowcount
+            
+            conn.commit()
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
         
-        conn.commit()
-        conn.close()
+        logger.info(f"Maintenance removed {logs_deleted} command logs and {sessions_deleted} expired sessions")
+    
+    def shutdown(self):
+        """Flush pending logs, refresh query planner stats and close connections"""
+        self._stop_event.set()
+        self.flush_logs()
+        with self.pool.acquire_writer() as conn:
+            conn.execute('PRAGMA optimize')
+        self.pool.close_all()
     
     def is_user_authenticated(self, facebook_id: str) -> bool:
         """Check if user is authenticated"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT us.expires_at FROM user_sessions us
-            JOIN users u ON us.facebook_id = u.facebook_id
-            WHERE us.facebook_id = ? AND us.expires_at > CURRENT_TIMESTAMP
-            ORDER BY us.created_at DESC LIMIT 1
-        ''', (facebook_id,))
+        with self._auth_lock:
+            expires = self._auth_cache.get(facebook_id)
+            if expires is not None:
+                if expires > time.time():
+                    self._auth_cache.move_to_end(facebook_id)
+                    return True
+                del self._auth_cache[facebook_id]
+        
+        with self.pool.acquire_reader() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT us.expires_at FROM user_sessions us
+                JOIN users u ON us.facebook_id = u.facebook_id
+                WHERE us.facebook_id = ? AND us.expires_at > CURRENT_TIMESTAMP
+                ORDER BY us.created_at DESC LIMIT 1
+            ''', (facebook_id,))
+            
+            result = cursor.fetchone()
         
-        result = cursor.fetchone()
-        conn.close()
+        if result is None:
+            return False
         
-        return result is not None
+        self._cache_auth(facebook_id, datetime.fromisoformat(result[0]))
+        return True
+    
+    def _cache_auth(self, facebook_id: str, expires_at: datetime):
+        """Remember a session expiry, evicting the least recently used entry"""
+        # expires_at is UTC, the same clock as SQLite's CURRENT_TIMESTAMP;
+        # naive values read back from the database are UTC too
+        session_expiry = expires_at.replace(tzinfo=timezone.utc).timestamp()
+        with self._auth_lock:
+            self._auth_cache[facebook_id] = min(session_expiry, time.time() + self.AUTH_CACHE_TTL)
+            self._auth_cache.move_to_end(facebook_id)
+            if len(self._auth_cache) > self.AUTH_CACHE_SIZE:
+                self._auth_cache.popitem(last=False)
+    
+    def _forget_auth(self, facebook_id: str):
+        """Drop a cached session so the next check goes to the database"""
+        with self._auth_lock:
+            self._auth_cache.pop(facebook_id, None)
     
     def authenticate_user(self, facebook_id: str, username: str, password: str) -> Tuple[bool, str]:
         """Authenticate user and create session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT password_hash FROM users 
-            WHERE username = ?
-        ''', (username,))
-        
-        result = cursor.fetchone()
+        # Check the password before taking the writer, hashing is slow
+        with self.pool.acquire_reader() as conn:
+            result = conn.execute('SELECT password_hash FROM users WHERE username = ?', (username,)).fetchone()
         
-        if not result or not check_password_hash(result[0], password):
-            conn.close()
+        if not result or not self._check_password(username, result[0], password):
             return False, "Invalid credentials"
+        verified_hash = result[0]
         
-        # Update or insert user's Facebook ID
-        cursor.execute('''
-            UPDATE users SET facebook_id = ?, last_login = CURRENT_TIMESTAMP
-            WHERE username = ?
-        ''', (facebook_id, username))
-        
-        # Create session
-        session_token = hashlib.sha256(f"{facebook_id}{datetime.now()}".encode()).hexdigest()
-        expires_at = datetime.now() + timedelta(hours=24)
-        
-        cursor.execute('''
-            INSERT INTO user_sessions (facebook_id, session_token, expires_at)
-            VALUES (?, ?, ?)
-        ''', (facebook_id, session_token, expires_at))
+        with self.pool.acquire_writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            cursor.execute('SELECT facebook_id, password_hash FROM users WHERE username = ?', (username,))
+            result = cursor.fetchone()
+            
+            # The password may have changed since it was verified above
+            if not result or result[1] != verified_hash:
+                conn.rollback()
+                return False, "Invalid credentials"
+            previous_facebook_id = result[0]
+            
+            # Only rewrite facebook_id (and its unique index) when it changes
+            if previous_facebook_id != facebook_id:
+                cursor.execute('''
+                    UPDATE users SET facebook_id = ?, last_login = CURRENT_TIMESTAMP
+                    WHERE username = ?
+                ''', (facebook_id, username))
+            else:
+                cursor.execute('''
+                    UPDATE users SET last_login = CURRENT_TIMESTAMP
+                    WHERE username = ?
+                ''', (username,))
+            
+            # Create session
+            session_token = secrets.token_hex(32)
+            # Stored in UTC like CURRENT_TIMESTAMP, which it is compared against
+            expires_at = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(hours=24)
+            
+            cursor.execute('''
+                INSERT INTO user_sessions (facebook_id, session_token, expires_at)
+                VALUES (?, ?, ?)
+            ''', (facebook_id, session_token, expires_at.strftime('%Y-%m-%d %H:%M:%S')))
+            
+            conn.commit()
         
-        conn.commit()
-        conn.close()
+        # Sessions of the previously linked account no longer join to this user
+        if previous_facebook_id != facebook_id:
+            self._forget_auth(previous_facebook_id)
+        self._cache_auth(facebook_id, expires_at)
         
         return True, "Authentication successful"
     
+    def _check_password(self, username: str, password_hash: str, password: str) -> bool:
+        """Verify a password, reusing results from the last PASSWORD_CACHE_TTL seconds"""
+        # Security tradeoff: for up to a minute a repeated guess costs one
+        # SHA-256 instead of a full PBKDF2 run, so this is no substitute for
+        # rate limiting. Only a fast digest of the password is kept in memory,
+        # and keying on the stored hash drops entries when the password changes.
+        key = (username, password_hash, hashlib.sha256(password.encode('utf-8')).digest())
+        now = time.time()
+        
+        with self._pw_lock:
+            cached = self._pw_cache.get(key)
+            if cached is not None:
+                if cached[1] > now:
+                    return cached[0]
+                del self._pw_cache[key]
+        
+        ok = check_password_hash(password_hash, password)
+        
+        with self._pw_lock:
+            self._pw_cache[key] = (ok, now + self.PASSWORD_CACHE_TTL)
+            if len(self._pw_cache) > self.PASSWORD_CACHE_SIZE:
+                self._pw_cache.popitem(last=False)
+        return ok
+    
     def get_item_count(self, item_id: str) -> Optional[int]:
         """Get current count for an item"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT count FROM items WHERE item_id = ?', (item_id,))
-        result = cursor.fetchone()
-        conn.close()
+        with self.pool.acquire_reader() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT count FROM items WHERE item_id = ?', (item_id,))
+            result = cursor.fetchone()
         
         return result[0] if result else None
     
     def modify_item_count(self, item_id: str, operation: str, amount: int = 1) -> Tuple[bool, str, int]:
         """Add or subtract from item count"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Check if item exists
-        cursor.execute('SELECT count FROM items WHERE item_id = ?', (item_id,))
-        result = cursor.fetchone()
-        
-        if not result:
-            # Create new item
-            cursor.execute('''
-                INSERT INTO items (item_id, name, count) 
-                VALUES (?, ?, ?)
-            ''', (item_id, item_id, 1 if operation == 'add' else 0))
-            new_count = 1 if operation == 'add' else 0
-        else:
-            current_count = result[0]
+        with self.pool.acquire_writer() as conn:
+            cursor = conn.cursor()
+            # The writer lock only covers this process, other gunicorn workers
+            # could interleave between the read and the write below
+            cursor.execute('BEGIN IMMEDIATE')
             
-            if operation == 'add':
-                new_count = current_count + amount
-            else:  # subtract
-                new_count = max(0, current_count - amount)
+            # Check if item exists
+            cursor.execute('SELECT count FROM items WHERE item_id = ?', (item_id,))
+            result = cursor.fetchone()
             
-            cursor.execute('''
-                UPDATE items SET count = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE item_id = ?
-            ''', (new_count, item_id))
-        
-        conn.commit()
-        conn.close()
+            if not result:
+                # Create new item
+                cursor.execute('''
+                    INSERT INTO items (item_id, name, count) 
+                    VALUES (?, ?, ?)
+                ''', (item_id, item_id, 1 if operation == 'add' else 0))
+                new_count = 1 if operation == 'add' else 0
+            else:
+                current_count = result[0]
+                
+                if operation == 'add':
+                    new_count = current_count + amount
+                else:  # subtract
+                    new_count = max(0, current_count - amount)
+                
+                cursor.execute('''
+                    UPDATE items SET count = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE item_id = ?
+                ''', (new_count, item_id))
+            
+            conn.commit()
         
         return True, f"Item {item_id} {operation}ed successfully", new_count
     
     def generate_statistics_report(self, facebook_id: str) -> str:
         """Generate Excel statistics report"""
-        conn = sqlite3.connect(self.db_path)
-        
-        # Get items data
-        items_df = pd.read_sql_query('''
-            SELECT item_id, name, count, created_at, updated_at 
-            FROM items ORDER BY updated_at DESC
-        ''', conn)
-        
-        # Get command logs
-        logs_df = pd.read_sql_query('''
-            SELECT command, COUNT(*) as usage_count, 
-                   MAX(timestamp) as last_used,
-                   SUM(success) as success_count,
-                   COUNT(*) - SUM(success) as error_count
-            FROM command_logs 
-            GROUP BY command
-            ORDER BY usage_count DESC
-        ''', conn)
-        
-        # Get user activity
-        activity_df = pd.read_sql_query('''
-            SELECT DATE(timestamp) as date, 
-                   COUNT(*) as commands_executed,
-                   COUNT(DISTINCT facebook_id) as unique_users
-            FROM command_logs 
-            WHERE timestamp >= datetime('now', '-30 days')
-            GROUP BY DATE(timestamp)
-            ORDER BY date DESC
-        ''', conn)
-        
-        conn.close()
+        self.flush_logs()
+        
+        with self.pool.acquire_reader() as conn:
+            # Get items data
+            items_df = pd.read_sql_query('''
+                SELECT item_id, name, count, created_at, updated_at 
+                FROM items ORDER BY updated_at DESC
+            ''', conn)
+            
+            # Get command logs
+            logs_df = pd.read_sql_query('''
+                SELECT command, COUNT(*) as usage_count, 
+                       MAX(timestamp) as last_used,
+                       SUM(success) as success_count,
+                       COUNT(*) - SUM(success) as error_count
+                FROM command_logs 
+                GROUP BY command
+                ORDER BY usage_count DESC
+            ''', conn)
+            
+            # Get user activity
+            activity_df = pd.read_sql_query('''
+                SELECT DATE(timestamp) as date, 
+                       COUNT(*) as commands_executed,
+                       COUNT(DISTINCT facebook_id) as unique_users
+                FROM command_logs 
+                WHERE timestamp >= datetime('now', '-30 days')
+                GROUP BY DATE(timestamp)
+                ORDER BY date DESC
+            ''', conn)
+            
+            # Get summary totals in one pass instead of reducing the frames
+            unique_users, total_commands = conn.execute('''
+                SELECT COUNT(DISTINCT facebook_id), COUNT(*) FROM command_logs
+            ''').fetchone()
         
         # Create Excel file
         filename = f"statistics_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
@@ -256,7 +487,10 @@ class FacebookMessengerBot:
         # Create reports directory if it doesn't exist
         os.makedirs('reports', exist_ok=True)
         
-        with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
+        # xlsxwriter serializes far faster than openpyxl's DOM. Its
+        # constant_memory mode can't be used: pandas writes cells column by
+        # column and that mode only accepts cells in row order.
+        with pd.ExcelWriter(filepath, engine='xlsxwriter') as writer:
             items_df.to_excel(writer, sheet_name='Items', index=False)
             logs_df.to_excel(writer, sheet_name='Command Usage', index=False)
             activity_df.to_excel(writer, sheet_name='Daily Activity', index=False)
@@ -271,8 +505,8 @@ class FacebookMessengerBot:
                 ],
                 'Value': [
                     len(items_df),
-                    logs_df['usage_count'].sum() if not logs_df.empty else 0,
-                    'N/A',  # Would need user tracking
+                    total_commands,
+                    unique_users,
                     datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 ]
             }
@@ -283,21 +517,22 @@ class FacebookMessengerBot:
     
     def send_message(self, recipient_id: str, message_text: str):
         """Send message to user via Facebook Messenger"""
-        url = f"https://graph.facebook.com/v18.0/me/messages?access_token={self.access_token}"
-        
         data = {
             "recipient": {"id": recipient_id},
             "message": {"text": message_text}
         }
         
-        response = requests.post(url, json=data)
+        try:
+            response = self._session.post(self._messages_url, json=data, timeout=self.HTTP_TIMEOUT)
+        except requests.RequestException as e:
+            # requests errors embed the URL, which carries the page access token
+            logger.error(f"Failed to send message: {type(e).__name__}")
+            return
         if response.status_code != 200:
             logger.error(f"Failed to send message: {response.text}")
     
     def send_file(self, recipient_id: str, file_path: str):
         """Send file to user via Facebook Messenger"""
-        url = f"https://graph.facebook.com/v18.0/me/messages?access_token={self.access_token}"
-        
         with open(file_path, 'rb') as f:
             files = {'filedata': f}
             data = {
@@ -310,87 +545,92 @@ class FacebookMessengerBot:
                 })
             }
             
-            response = requests.post(url, data=data, files=files)
+            response = self._session.post(self._messages_url, data=data, files=files, timeout=self.HTTP_TIMEOUT)
             if response.status_code != 200:
                 logger.error(f"Failed to send file: {response.text}")
     
+    def _cmd_statistics(self, facebook_id: str, command: str) -> Tuple[str, Optional[Dict]]:
+        """Build and upload the Excel report in the background"""
+        # Report generation and the multipart upload are the slowest path, keep
+        # them off the webhook so Facebook doesn't retry and request it twice
+        _send_pool.submit(self._send_statistics_report, facebook_id)
+        return "Generating statistics report, it will be sent shortly.", None
+    
+    def _send_statistics_report(self, facebook_id: str):
+        """Generate the Excel report and send it to the user"""
+        try:
+            report_path = self.generate_statistics_report(facebook_id)
+            self.send_file(facebook_id, report_path)
+            self.log_command(facebook_id, 'statistics', success=True)
+        except Exception as e:
+            # Only the exception type is recorded: requests errors embed the
+            # Graph API URL and with it the page access token
+            logger.error(f"Failed to send statistics report: {type(e).__name__}")
+            self.log_command(facebook_id, 'statistics', success=False, error_message=type(e).__name__)
+            self.send_message(facebook_id, "Sorry, the statistics report could not be generated. Please try again later.")
+    
+    def _cmd_add(self, facebook_id: str, command: str) -> Tuple[str, Dict]:
+        """Add 1 to the current item count"""
+        # For simplicity, using a default item. In practice, you'd track current item per user
+        success, message, new_count = self.modify_item_count('default_item', 'add')
+        return f"{message}. New count: {new_count}", {'command': 'add', 'parameters': 'default_item', 'success': success}
+    
+    def _cmd_subtract(self, facebook_id: str, command: str) -> Tuple[str, Dict]:
+        """Subtract 1 from the current item count"""
+        success, message, new_count = self.modify_item_count('default_item', 'subtract')
+        return f"{message}. New count: {new_count}", {'command': 'subtract', 'parameters': 'default_item', 'success': success}
+    
+    def _cmd_count(self, facebook_id: str, command: str) -> Tuple[str, Dict]:
+        """Report the current item count"""
+        count = self.get_item_count('default_item')
+        count = count if count is not None else 0
+        return f"Current count for default_item: {count}", {'command': 'count', 'parameters': 'default_item', 'success': True}
+    
+    def _cmd_set_item(self, facebook_id: str, command: str) -> Tuple[str, Dict]:
+        """Treat any other command as an item ID to select"""
+        # Store current item for user (simplified - in practice, use session storage)
+        return (f"Item '{command}' selected. Use [add], [subtract], or [count] to interact with it.",
+                {'command': 'set_item', 'parameters': command, 'success': True})
+    
     def process_command(self, facebook_id: str, message_text: str) -> str:
         """Process incoming command and return response"""
-        message_text = message_text.strip()
+        match = _CMD_RE.match(message_text)
+        content = match.group(1) if match else None
         
         # Help command
-        if message_text == '[help]':
+        if content == 'help':
             self.log_command(facebook_id, 'help', success=True)
-            return """Available commands:
-[help] - Show this help message
-[username] [password] - Login (e.g., [admin] [admin123])
-[itemID] - Set target item for operations
-[add] - Add 1 to current item count
-[subtract] - Subtract 1 from current item count
-[count] - Get current count for item
-[statistics] - Generate and send Excel report
-
-Note: You must be authenticated to use commands other than [help]."""
+            return self.HELP_TEXT
+        
+        authenticated = self.is_user_authenticated(facebook_id)
         
         # Authentication commands
-        if message_text.startswith('[') and message_text.endswith(']'):
-            # Parse potential username/password
-            content = message_text[1:-1]
-            
-            # Check if this looks like a login attempt
-            if not self.is_user_authenticated(facebook_id):
-                # Try to authenticate
-                success, message = self.authenticate_user(facebook_id, content, content)
-                if success:
-                    self.log_command(facebook_id, 'login', content, success=True)
-                    return message
-                else:
-                    # Could be a command that requires auth
-                    return "Please authenticate first. Use [username] followed by [password] or use [help] for instructions."
+        if content is not None and not authenticated:
+            # Try to authenticate
+            success, message = self.authenticate_user(facebook_id, content, content)
+            if success:
+                self.log_command(facebook_id, 'login', content, success=True)
+                return message
+            else:
+                # Could be a command that requires auth
+                return "Please authenticate first. Use [username] followed by [password] or use [help] for instructions."
         
         # Check authentication for other commands
-        if not self.is_user_authenticated(facebook_id):
+        if not authenticated:
             return "You must be authenticated to use this command. Please login first."
         
         # Parse authenticated commands
-        if message_text.startswith('[') and message_text.endswith(']'):
-            command = message_text[1:-1].lower()
-            
-            if command == 'statistics':
-                try:
-                    report_path = self.generate_statistics_report(facebook_id)
-                    self.send_file(facebook_id, report_path)
-                    self.log_command(facebook_id, 'statistics', success=True)
-                    return "Statistics report generated and sent!"
-                except Exception as e:
-                    self.log_command(facebook_id, 'statistics', success=False, error_message=str(e))
-                    return f"Error generating report: {str(e)}"
-            
-            elif command == 'add':
-                # For simplicity, using a default item. In practice, you'd track current item per user
-                success, message, new_count = self.modify_item_count('default_item', 'add')
-                self.log_command(facebook_id, 'add', 'default_item', success=success)
-                return f"{message}. New count: {new_count}"
-            
-            elif command == 'subtract':
-                success, message, new_count = self.modify_item_count('default_item', 'subtract')
-                self.log_command(facebook_id, 'subtract', 'default_item', success=success)
-                return f"{message}. New count: {new_count}"
-            
-            elif command == 'count':
-                count = self.get_item_count('default_item')
-                count = count if count is not None else 0
-                self.log_command(facebook_id, 'count', 'default_item', success=True)
-                return f"Current count for default_item: {count}"
-            
-            else:
-                # Treat as item ID
-                # Store current item for user (simplified - in practice, use session storage)
-                self.log_command(facebook_id, 'set_item', command, success=True)
-                return f"Item '{command}' selected. Use [add], [subtract], or [count] to interact with it."
+        if content is not None:
+            command = content.lower()
+            handler = self._handlers.get(command, self._cmd_set_item)
+            response, log_kwargs = handler(facebook_id, command)
+            # Background handlers log their own outcome
+            if log_kwargs is not None:
+                self.log_command(facebook_id, **log_kwargs)
+            return response
         
         # Unknown command
-        self.log_command(facebook_id, 'unknown', message_text, success=False, error_message="Unknown command")
+        self.log_command(facebook_id, 'unknown', message_text.strip(), success=False, error_message="Unknown command")
         return "Unknown command. Use [help] to see available commands."
 
 # Flask application
@@ -403,6 +643,7 @@ APP_SECRET = os.getenv('FACEBOOK_APP_SECRET', 'your_app_secret_here')
 
 # Initialize bot
 bot = FacebookMessengerBot(VERIFY_TOKEN, ACCESS_TOKEN, APP_SECRET)
+atexit.register(bot.shutdown)
 
 @app.route('/webhook', methods=['GET'])
 def verify_webhook():
@@ -423,11 +664,16 @@ def handle_webhook():
     """Handle incoming messages from Facebook"""
     # Verify signature
     signature = request.headers.get('X-Hub-Signature-256')
-    if not bot.verify_webhook_signature(request.get_data(as_text=True), signature):
+    raw_body = request.get_data()
+    if not bot.verify_webhook_signature(raw_body, signature):
         logger.warning("Invalid webhook signature")
         return 'Invalid signature', 403
     
-    data = request.get_json()
+    try:
+        data = json.loads(raw_body)
+    except ValueError:
+        logger.warning("Malformed webhook body")
+        return 'Invalid JSON', 400
     
     if data.get('object') == 'page':
         for entry in data.get('entry', []):
@@ -440,20 +686,42 @@ def handle_webhook():
                     
                     # Process command and send response
                     response = bot.process_command(sender_id, message_text)
-                    bot.send_message(sender_id, response)
+                    _send_pool.submit(bot.send_message, sender_id, response)
     
     return 'OK', 200
 
+@app.route('/pool-health', methods=['GET'])
+def pool_health():
+    """Database connection pool health endpoint"""
+    return jsonify(bot.pool.stats())
+
+# (monotonic computed_at, payload) of the last health check, reused for up to a second
+_last_health = (float('-inf'), None)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.now().isoformat(),
-        'version': '1.0.0'
-    })
+    global _last_health
+    now = time.monotonic()
+    if now - _last_health[0] >= 1.0:
+        _last_health = (now, {
+            'status': 'healthy',
+            'timestamp': datetime.now().isoformat(),
+            'version': '1.0.0'
+        })
+    return jsonify(_last_health[1])
 
 if __name__ == '__main__':
+    # Local development only. In production serve the app with gunicorn so
+    # webhooks are handled by several workers and threads, e.g.
+    #   gunicorn -w 4 -k gthread --threads 8 -b 0.0.0.0:$PORT app:app
+    # Pooled SQLite connections are opened with check_same_thread=False and
+    # the database runs in WAL mode. Writes that read before they write
+    # (schema setup, login, item counts) use BEGIN IMMEDIATE, because the
+    # pool's writer lock only serializes threads within one process. The
+    # in-memory auth and password caches are per process; other workers pick
+    # up a relinked account within their TTL.
+    
     # Create reports directory
     os.makedirs('reports', exist_ok=True)
     
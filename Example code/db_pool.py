@@ -0,0 +1,174 @@
+import sqlite3
+import threading
+import time
+import logging
+from collections import deque
+from urllib.parse import quote
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Applied once to every pooled connection. journal_mode persists in the
+# database file so only the writer sets it, the rest are per-connection.
+WRITER_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-64000;
+    PRAGMA mmap_size=268435456;
+"""
+
+READER_PRAGMAS = """
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-64000;
+    PRAGMA mmap_size=268435456;
+"""
+
+# sqlite3 keeps an LRU of compiled statements per connection, keyed by SQL
+# text. Because pooled connections live for the life of the process, each
+# query is prepared once and then only re-bound, as long as the cache is big
+# enough to hold every distinct statement the bot issues.
+STATEMENT_CACHE_SIZE = 256
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+class SQLitePool:
+    """One dedicated writer plus a bounded pool of read-only SQLite connections"""
+
+    def __init__(self, db_path: str, min_size: int = 2, max_size: int = 10,
+                 timeout: float = 30.0, idle_timeout: float = 300.0):
+        self.db_path = db_path
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+
+        # Idle readers, oldest on the left. Checkout takes from the right so
+        # busy periods reuse warm connections and stale ones can be reaped
+        # from the left.
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._total = 0
+        self._active = 0
+
+        # The writer must exist first: it creates the file and switches it to
+        # WAL, which is what lets the read-only connections run alongside it
+        self._writer = self._connect('rwc')
+        self._writer.executescript(WRITER_PRAGMAS)
+        self._writer_lock = threading.Lock()
+
+        for _ in range(min_size):
+            self._idle.append((self._create_connection(), time.monotonic()))
+            self._total += 1
+        logger.info(f"SQLite pool ready with 1 writer and {min_size} readers")
+
+    def _connect(self, mode: str) -> sqlite3.Connection:
+        """Open a URI connection in the given mode usable from any worker thread"""
+        uri = f"file:{quote(self.db_path)}?mode={mode}"
+        return sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+
+    def _create_connection(self) -> sqlite3.Connection:
+        """Open a new read-only connection"""
+        conn = self._connect('ro')
+        conn.executescript(READER_PRAGMAS)
+        return conn
+
+    def _checkout(self) -> sqlite3.Connection:
+        """Take an idle reader, opening a new one while under max_size"""
+        deadline = time.monotonic() + self.timeout
+
+        with self._available:
+            while True:
+                if self._idle:
+                    conn, _ = self._idle.pop()
+                    self._active += 1
+                    return conn
+                if self._total < self.max_size:
+                    # Reserve the slot before connecting so concurrent
+                    # callers can't all grow the pool past max_size
+                    self._total += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(f"No database connection available after {self.timeout}s")
+                self._available.wait(remaining)
+
+        try:
+            conn = self._create_connection()
+        except Exception:
+            with self._available:
+                self._total -= 1
+                self._available.notify()
+            raise
+
+        with self._lock:
+            self._active += 1
+        return conn
+
+    def _checkin(self, conn: sqlite3.Connection):
+        """Return a reader to the idle list and close readers idle too long"""
+        now = time.monotonic()
+        stale = []
+        with self._available:
+            self._active -= 1
+            self._idle.append((conn, now))
+            # Shrink back towards min_size from the least recently used end
+            while (self._total > self.min_size and self._idle
+                   and now - self._idle[0][1] > self.idle_timeout):
+                stale.append(self._idle.popleft()[0])
+                self._total -= 1
+            self._available.notify()
+
+        for old in stale:
+            old.close()
+
+    @contextmanager
+    def acquire_reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read-only connection for the duration of a with-block"""
+        conn = self._checkout()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._checkin(conn)
+
+    @contextmanager
+    def acquire_writer(self) -> Iterator[sqlite3.Connection]:
+        """Hold the single read-write connection for the duration of a with-block"""
+        if not self._writer_lock.acquire(timeout=self.timeout):
+            raise PoolTimeoutError(f"Writer connection busy for more than {self.timeout}s")
+        try:
+            yield self._writer
+        except Exception:
+            self._writer.rollback()
+            raise
+        finally:
+            self._writer_lock.release()
+
+    def stats(self) -> Dict[str, int]:
+        """Report writer state and active, idle and total reader counts"""
+        with self._lock:
+            return {
+                'writer_busy': self._writer_lock.locked(),
+                'active': self._active,
+                'idle': len(self._idle),
+                'total': self._total,
+                'max': self.max_size
+            }
+
+    def close_all(self):
+        """Close the writer and every idle reader in the pool"""
+        with self._writer_lock:
+            self._writer.close()
+        with self._available:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._total -= len(idle)
+        for conn in idle:
+            conn.close()